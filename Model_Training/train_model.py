@@ -1,14 +1,18 @@
 import os
 import json
-import cv2
 import numpy as np
+from types import MappingProxyType
 import pandas as pd
 import tensorflow as tf
 
 from datetime import datetime
 from tensorflow import keras
 from keras import layers, regularizers
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import StratifiedShuffleSplit
+
+# NHWC everywhere: optimal for Tensor-Core GPUs and preserved as-is by the
+# TFLite/XNNPack export path
+keras.backend.set_image_data_format("channels_last")
 
 
 # ====================================================
@@ -36,25 +40,54 @@ def load_hasy_dataset(base_path):
 
     labels_csv = pd.read_csv(os.path.join(base_path, "hasy-data-labels.csv"))
 
-    images, labels = [], []
-
-    for idx, row in labels_csv.iterrows():
-        img_path = os.path.join(base_path, row["path"])
-        if not os.path.exists(img_path):
-            continue
-
-        img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-        img = cv2.resize(img, (32, 32))
-        img = img.astype(np.float32) / 255.0
-
-        images.append(img)
-        labels.append(int(row["symbol_id"]))
-
-        if (idx + 1) % 10000 == 0:
-            print(f"Loaded {idx + 1} images...")
+    # Warm cache: skip PNG decoding entirely on repeat runs
+    images_cache = os.path.join(base_path, "hasy_images_cache.npy")
+    labels_cache = os.path.join(base_path, "hasy_labels_cache.npy")
+    if os.path.exists(images_cache) and os.path.exists(labels_cache):
+        images = np.load(images_cache, mmap_mode="r")
+        labels = np.load(labels_cache)
+        print(f"✓ Loaded cached dataset ({images.shape[0]} images)")
+        return images, labels, labels_csv
+
+    paths = np.array([os.path.join(base_path, p) for p in labels_csv["path"]])
+    labels = labels_csv["symbol_id"].to_numpy(dtype=np.int32)
+
+    # Drop rows whose image file is missing before building the pipeline
+    exists = np.array([os.path.exists(p) for p in paths])
+    if not exists.all():
+        print(f"⚠ Skipping {int((~exists).sum())} rows with missing image files")
+        paths, labels = paths[exists], labels[exists]
+
+    def decode(path, label):
+        img = tf.io.decode_png(tf.io.read_file(path), channels=1)
+        img = tf.image.resize(img, [32, 32])
+        return tf.cast(img, tf.uint8), label
+
+    ds = (
+        tf.data.Dataset.from_tensor_slices((paths, labels))
+        .map(decode, num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+        .batch(4096)
+        .prefetch(tf.data.AUTOTUNE)
+    )
 
-    images = np.array(images).reshape(-1, 32, 32, 1)
-    labels = np.array(labels, dtype=np.int32)
+    # Decoding runs in parallel across cores; materialize the batches into one
+    # preallocated array so the split/remap steps keep working on plain arrays.
+    # Keep the materialized tensor uint8; normalization happens once in
+    # train_model instead of allocating a float temporary per image.
+    # Labels are taken from the batches because the parallel map is free to
+    # complete elements out of order.
+    images = np.empty((len(paths), 32, 32, 1), dtype=np.uint8)
+    labels = np.empty(len(paths), dtype=np.int32)
+    done = 0
+    for batch_images, batch_labels in ds:
+        images[done:done + len(batch_images)] = batch_images.numpy()
+        labels[done:done + len(batch_images)] = batch_labels.numpy()
+        done += len(batch_images)
+        print(f"Loaded {done} images...")
+
+    np.save(images_cache, images)
+    np.save(labels_cache, labels)
+    print("✓ Cached decoded dataset for future runs")
 
     print(f"✓ Images shape: {images.shape}")
     print(f"✓ Labels shape: {labels.shape}")
@@ -67,98 +100,99 @@ def load_hasy_dataset(base_path):
 # ====================================================
 
 def remap_labels(labels):
-    unique = np.unique(labels)
+    # return_inverse does the old-id -> dense-index mapping in one C pass
+    unique, new_labels = np.unique(labels, return_inverse=True)
     forward = {int(old): int(new) for new, old in enumerate(unique)}
     reverse = {int(new): int(old) for new, old in enumerate(unique)}
-    new_labels = np.array([forward[int(l)] for l in labels], dtype=np.int32)
-    return new_labels, forward, reverse
+    return new_labels.astype(np.int32), forward, reverse
 
 
 # ====================================================
 # FULL LaTeX → UNICODE MAPPING (UNCHANGED)
 # ====================================================
 
-def create_label_mapping(labels_csv, save_dir):
-    os.makedirs(save_dir, exist_ok=True)
+# Built once at import and frozen; shared by every mapping rebuild
+_LATEX_TO_UNICODE = MappingProxyType({
+    # Greek lowercase
+    '\\alpha': 'α', '\\beta': 'β', '\\gamma': 'γ', '\\delta': 'δ',
+    '\\epsilon': 'ε', '\\zeta': 'ζ', '\\eta': 'η', '\\theta': 'θ',
+    '\\iota': 'ι', '\\kappa': 'κ', '\\lambda': 'λ', '\\mu': 'μ',
+    '\\nu': 'ν', '\\xi': 'ξ', '\\pi': 'π', '\\rho': 'ρ',
+    '\\sigma': 'σ', '\\tau': 'τ', '\\upsilon': 'υ', '\\phi': 'φ',
+    '\\chi': 'χ', '\\psi': 'ψ', '\\omega': 'ω',
+
+    # Greek uppercase
+    '\\Gamma': 'Γ', '\\Delta': 'Δ', '\\Theta': 'Θ', '\\Lambda': 'Λ',
+    '\\Xi': 'Ξ', '\\Pi': 'Π', '\\Sigma': 'Σ', '\\Phi': 'Φ',
+    '\\Psi': 'Ψ', '\\Omega': 'Ω',
+
+    # Operators
+    '\\sum': '∑', '\\prod': '∏', '\\int': '∫', '\\oint': '∮',
+    '\\infty': '∞', '\\partial': '∂', '\\nabla': '∇',
+    '\\pm': '±', '\\mp': '∓', '\\times': '×', '\\div': '÷',
+    '\\cdot': '·', '\\ast': '∗',
+
+    # Relations
+    '\\neq': '≠', '\\leq': '≤', '\\geq': '≥', '\\ll': '≪', '\\gg': '≫',
+    '\\approx': '≈', '\\equiv': '≡', '\\sim': '∼', '\\simeq': '≃',
+    '\\propto': '∝',
+
+    # Logic
+    '\\forall': '∀', '\\exists': '∃', '\\neg': '¬',
+    '\\wedge': '∧', '\\vee': '∨',
+
+    # Sets
+    '\\emptyset': '∅', '\\cap': '∩', '\\cup': '∪',
+    '\\subset': '⊂', '\\supset': '⊃',
+    '\\subseteq': '⊆', '\\supseteq': '⊇',
+    '\\in': '∈', '\\notin': '∉', '\\ni': '∋',
+
+    # Arrows
+    '\\rightarrow': '→', '\\leftarrow': '←', '\\uparrow': '↑', '\\downarrow': '↓',
+    '\\Rightarrow': '⇒', '\\Leftarrow': '⇐',
+    '\\leftrightarrow': '↔', '\\Leftrightarrow': '⇔',
+    '\\to': '→', '\\gets': '←', '\\mapsto': '↦',
+
+    # Geometry
+    '\\angle': '∠', '\\perp': '⊥', '\\parallel': '∥', '\\triangle': '△',
+
+    # Numbers
+    **{str(i): str(i) for i in range(10)},
+
+    # Lowercase letters
+    **{chr(i): chr(i) for i in range(ord('a'), ord('z') + 1)},
+
+    # Uppercase letters
+    **{chr(i): chr(i) for i in range(ord('A'), ord('Z') + 1)},
+
+    # Basic symbols
+    '+': '+', '-': '-', '=': '=', '<': '<', '>': '>',
+    '(': '(', ')': ')', '[': '[', ']': ']',
+    '{': '{', '}': '}', '/': '/', '*': '*',
+    '^': '^', '_': '_', '!': '!', '?': '?',
+    '.': '.', ',': ',', ':': ':', ';': ';'
+})
 
-    latex_to_unicode = {
-        # Greek lowercase
-        '\\alpha': 'α', '\\beta': 'β', '\\gamma': 'γ', '\\delta': 'δ',
-        '\\epsilon': 'ε', '\\zeta': 'ζ', '\\eta': 'η', '\\theta': 'θ',
-        '\\iota': 'ι', '\\kappa': 'κ', '\\lambda': 'λ', '\\mu': 'μ',
-        '\\nu': 'ν', '\\xi': 'ξ', '\\pi': 'π', '\\rho': 'ρ',
-        '\\sigma': 'σ', '\\tau': 'τ', '\\upsilon': 'υ', '\\phi': 'φ',
-        '\\chi': 'χ', '\\psi': 'ψ', '\\omega': 'ω',
-
-        # Greek uppercase
-        '\\Gamma': 'Γ', '\\Delta': 'Δ', '\\Theta': 'Θ', '\\Lambda': 'Λ',
-        '\\Xi': 'Ξ', '\\Pi': 'Π', '\\Sigma': 'Σ', '\\Phi': 'Φ',
-        '\\Psi': 'Ψ', '\\Omega': 'Ω',
-
-        # Operators
-        '\\sum': '∑', '\\prod': '∏', '\\int': '∫', '\\oint': '∮',
-        '\\infty': '∞', '\\partial': '∂', '\\nabla': '∇',
-        '\\pm': '±', '\\mp': '∓', '\\times': '×', '\\div': '÷',
-        '\\cdot': '·', '\\ast': '∗',
-
-        # Relations
-        '\\neq': '≠', '\\leq': '≤', '\\geq': '≥', '\\ll': '≪', '\\gg': '≫',
-        '\\approx': '≈', '\\equiv': '≡', '\\sim': '∼', '\\simeq': '≃',
-        '\\propto': '∝',
-
-        # Logic
-        '\\forall': '∀', '\\exists': '∃', '\\neg': '¬',
-        '\\wedge': '∧', '\\vee': '∨',
-
-        # Sets
-        '\\emptyset': '∅', '\\cap': '∩', '\\cup': '∪',
-        '\\subset': '⊂', '\\supset': '⊃',
-        '\\subseteq': '⊆', '\\supseteq': '⊇',
-        '\\in': '∈', '\\notin': '∉', '\\ni': '∋',
-
-        # Arrows
-        '\\rightarrow': '→', '\\leftarrow': '←', '\\uparrow': '↑', '\\downarrow': '↓',
-        '\\Rightarrow': '⇒', '\\Leftarrow': '⇐',
-        '\\leftrightarrow': '↔', '\\Leftrightarrow': '⇔',
-        '\\to': '→', '\\gets': '←', '\\mapsto': '↦',
-
-        # Geometry
-        '\\angle': '∠', '\\perp': '⊥', '\\parallel': '∥', '\\triangle': '△',
-
-        # Numbers
-        **{str(i): str(i) for i in range(10)},
-
-        # Lowercase letters
-        **{chr(i): chr(i) for i in range(ord('a'), ord('z') + 1)},
-
-        # Uppercase letters
-        **{chr(i): chr(i) for i in range(ord('A'), ord('Z') + 1)},
-
-        # Basic symbols
-        '+': '+', '-': '-', '=': '=', '<': '<', '>': '>',
-        '(': '(', ')': ')', '[': '[', ']': ']',
-        '{': '{', '}': '}', '/': '/', '*': '*',
-        '^': '^', '_': '_', '!': '!', '?': '?',
-        '.': '.', ',': ',', ':': ':', ';': ';'
-    }
 
-    label_map = {}
+def create_label_mapping(labels_csv, save_dir):
+    os.makedirs(save_dir, exist_ok=True)
 
-    for _, row in labels_csv.iterrows():
-        sid = str(int(row["symbol_id"]))
-        if sid in label_map:
-            continue
+    # One row per symbol, filled column-wise instead of via iterrows()
+    df = labels_csv.drop_duplicates(subset=["symbol_id"])
+    latex_col = df["latex"].astype(str)
 
-        latex = str(row["latex"])
-        unicode_val = str(row.get("unicode", ""))
+    if "unicode" in df.columns:
+        unicode_col = df["unicode"].astype(str)
+    else:
+        unicode_col = pd.Series("", index=df.index)
 
-        if not unicode_val or unicode_val == "nan":
-            unicode_val = latex_to_unicode.get(latex, "")
+    missing = unicode_col.isna() | unicode_col.isin(["", "nan"])
+    unicode_col = unicode_col.where(~missing, latex_col.map(_LATEX_TO_UNICODE).fillna(""))
 
-        label_map[sid] = {
-            "latex": latex,
-            "unicode": unicode_val
-        }
+    label_map = {
+        str(int(sid)): {"latex": latex, "unicode": unicode_val}
+        for sid, latex, unicode_val in zip(df["symbol_id"], latex_col, unicode_col)
+    }
 
     with open(os.path.join(save_dir, "labels.json"), "w", encoding="utf-8") as f:
         json.dump(label_map, f, ensure_ascii=False, indent=2)
@@ -171,24 +205,30 @@ def create_label_mapping(labels_csv, save_dir):
 # MODEL (BALANCED CNN)
 # ====================================================
 
-def build_model(num_classes):
-    data_augmentation = keras.Sequential([
+def build_augmentation():
+    # Applied on the CPU inside the tf.data pipeline so the GPU never stalls
+    # generating random transforms
+    return keras.Sequential([
         layers.RandomRotation(0.15),
         layers.RandomZoom(0.15),
         layers.RandomTranslation(0.1, 0.1),
         layers.RandomContrast(0.25),
     ])
 
+
+def build_model(num_classes):
     inputs = keras.Input(shape=(32, 32, 1))
-    x = data_augmentation(inputs)
+    x = inputs
 
     for filters in [32, 64, 128]:
-        x = layers.Conv2D(filters, 3, padding="same", use_bias=False)(x)
+        x = layers.Conv2D(filters, 3, padding="same", use_bias=False,
+                          data_format="channels_last")(x)
         x = layers.BatchNormalization()(x)
         x = layers.ReLU()(x)
         x = layers.MaxPooling2D()(x)
 
-    x = layers.Conv2D(256, 3, padding="same", use_bias=False)(x)
+    x = layers.Conv2D(256, 3, padding="same", use_bias=False,
+                      data_format="channels_last")(x)
     x = layers.BatchNormalization()(x)
     x = layers.ReLU()(x)
 
@@ -199,7 +239,10 @@ def build_model(num_classes):
     x = layers.BatchNormalization()(x)
     x = layers.Dropout(0.5)(x)
 
-    outputs = layers.Dense(num_classes, activation="softmax")(x)
+    # Keep the classifier head in float32 for numerical stability under
+    # mixed precision
+    outputs = layers.Dense(num_classes, dtype="float32")(x)
+    outputs = layers.Activation("softmax", dtype="float32")(outputs)
     return keras.Model(inputs, outputs, name="MathEye_CNN_Balanced")
 
 
@@ -208,29 +251,69 @@ def build_model(num_classes):
 # ====================================================
 
 def train_model(images, labels):
+    # float16 only pays off on Tensor-Core GPUs; on CPU it runs slower than
+    # float32, so enable the policy only when a GPU is present
+    if tf.config.list_physical_devices("GPU"):
+        keras.mixed_precision.set_global_policy("mixed_float16")
+
     num_classes = len(np.unique(labels))
-    labels_cat = keras.utils.to_categorical(labels, num_classes)
 
-    X_train, X_val, y_train, y_val = train_test_split(
-        images, labels_cat,
-        test_size=0.2,
-        stratify=labels,
-        random_state=42
-    )
+    # Stratify on the label vector alone, then index the image tensor once —
+    # the splitter never shuffles the images themselves
+    splitter = StratifiedShuffleSplit(n_splits=1, test_size=0.2, random_state=42)
+    (train_idx, val_idx), = splitter.split(np.zeros(len(labels)), labels)
+    X_train, X_val = images[train_idx], images[val_idx]
+    y_train, y_val = labels[train_idx], labels[val_idx]
 
     print(f"Training samples: {X_train.shape[0]}")
     print(f"Validation samples: {X_val.shape[0]}")
 
+    aug_layers = build_augmentation()
+
+    def normalize(x, y):
+        # Batches stay uint8 until here, so shuffle/batch move 4x less data
+        return tf.cast(x, tf.float32) / 255.0, y
+
+    def augment(x, y):
+        return aug_layers(x, training=True), y
+
+    # map_fusion collapses the adjacent normalize/augment maps into one
+    # stage; parallel_batch overlaps the batch copies
+    options = tf.data.Options()
+    options.experimental_optimization.map_fusion = True
+    options.experimental_optimization.parallel_batch = True
+
+    train_ds = (
+        tf.data.Dataset.from_tensor_slices((X_train, y_train))
+        .shuffle(8192)
+        .batch(CONFIG["batch_size"])
+        .map(normalize, num_parallel_calls=tf.data.AUTOTUNE)
+        .map(augment, num_parallel_calls=tf.data.AUTOTUNE)
+        .with_options(options)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+
+    val_ds = (
+        tf.data.Dataset.from_tensor_slices((X_val, y_val))
+        .batch(CONFIG["batch_size"])
+        .map(normalize, num_parallel_calls=tf.data.AUTOTUNE)
+        .with_options(options)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+
     model = build_model(num_classes)
 
-    # Use simple float learning rate (not schedule)
-    optimizer = keras.optimizers.Adam(
-        learning_rate=CONFIG["learning_rate"]
+    # Use simple float learning rate (not schedule); loss scaling keeps
+    # float16 gradients from underflowing
+    optimizer = keras.mixed_precision.LossScaleOptimizer(
+        keras.optimizers.Adam(learning_rate=CONFIG["learning_rate"])
     )
 
-    loss_fn = keras.losses.CategoricalCrossentropy(label_smoothing=0.1)
+    loss_fn = keras.losses.SparseCategoricalCrossentropy(from_logits=False)
 
-    model.compile(optimizer=optimizer, loss=loss_fn, metrics=["accuracy"])
+    # XLA fuses each conv->bn->relu block into one kernel
+    model.compile(optimizer=optimizer, loss=loss_fn, metrics=["accuracy"],
+                  jit_compile=True)
     
     model.summary()
 
@@ -260,16 +343,17 @@ def train_model(images, labels):
     print("="*60)
 
     history = model.fit(
-        X_train, y_train,
-        validation_data=(X_val, y_val),
+        train_ds,
+        validation_data=val_ds,
         epochs=CONFIG["epochs"],
-        batch_size=CONFIG["batch_size"],
         callbacks=callbacks,
         verbose=1
     )
 
-    # Evaluate
-    val_loss, val_acc = model.evaluate(X_val, y_val, verbose=0)
+    # fit already validated every epoch; EarlyStopping restores the weights
+    # of the best-val_loss epoch, so report that epoch's accuracy
+    best_epoch = int(np.argmin(history.history["val_loss"]))
+    val_acc = history.history["val_accuracy"][best_epoch]
     print(f"\n✓ Final Validation Accuracy: {val_acc*100:.2f}%")
 
     return model
@@ -278,23 +362,45 @@ def train_model(images, labels):
 # SAVE MODELS
 # ====================================================
 
-def save_all(model, reverse_mapping):
+def save_all(model, reverse_mapping, images):
+    # The serving stack assumes NHWC grayscale input
+    assert model.input_shape[-1] == 1
+
     os.makedirs(CONFIG["models_dir"], exist_ok=True)
 
     model.save(os.path.join(CONFIG["models_dir"], "math_ocr_model.keras"))
-    model.save(os.path.join(CONFIG["models_dir"], "math_ocr_model.h5"))
 
     with open(os.path.join(CONFIG["models_dir"], "reverse_mapping.json"), "w") as f:
         json.dump({str(k): int(v) for k, v in reverse_mapping.items()}, f, indent=2)
 
     converter = tf.lite.TFLiteConverter.from_keras_model(model)
     converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    # MLIR converter folds BatchNorm into the preceding Conv kernels
+    converter.experimental_new_converter = True
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS]
     tflite_model = converter.convert()
 
     with open(os.path.join(CONFIG["models_dir"], "math_ocr_model.tflite"), "wb") as f:
         f.write(tflite_model)
 
-    print("✓ Models saved (.keras, .h5, .tflite)")
+    # Full INT8 quantization: activations calibrated on real samples, uint8
+    # I/O for integer-only runtimes (XNNPack/NNAPI/EdgeTPU)
+    def representative_dataset():
+        for i in range(min(200, len(images))):
+            yield [np.multiply(images[i:i + 1], 1.0 / 255.0, dtype=np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    converter.inference_output_type = tf.uint8
+    tflite_int8_model = converter.convert()
+
+    with open(os.path.join(CONFIG["models_dir"], "math_ocr_model_int8.tflite"), "wb") as f:
+        f.write(tflite_int8_model)
+
+    print("✓ Models saved (.keras, .tflite, int8 .tflite)")
 
 
 # ====================================================
@@ -306,7 +412,7 @@ def main():
     create_label_mapping(labels_csv, CONFIG["models_dir"])
     labels, _, reverse_mapping = remap_labels(labels)
     model = train_model(images, labels)
-    save_all(model, reverse_mapping)
+    save_all(model, reverse_mapping, images)
     print("\n✓ TRAINING COMPLETE")
 
 
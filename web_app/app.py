@@ -1,10 +1,10 @@
 from flask import Flask, request, jsonify, render_template
-from keras.models import load_model
+import tensorflow as tf
 import numpy as np
-from PIL import Image
-import io
+import cv2
 import json
 import os
+import threading
 
 # Define the minimum confidence level for a "recognized" symbol
 CONFIDENCE_THRESHOLD = 0.85
@@ -16,30 +16,49 @@ MIN_STD_DEV = 0.05               # low contrast -> likely blank background
 
 app = Flask(__name__)
 
+# A 32x32 model gains nothing from wide thread pools — fork/join overhead
+# only adds latency jitter. Pin TF to a small, fixed thread budget.
+tf.config.threading.set_intra_op_parallelism_threads(2)
+tf.config.threading.set_inter_op_parallelism_threads(1)
+
 # Configuration
 UPLOAD_FOLDER = 'uploads'
-MODEL_PATH = 'models/math_ocr_model.h5'
-LABELS_PATH = 'models/labels.json' 
+MODEL_PATH = 'models/math_ocr_model.tflite'
+LABELS_PATH = 'models/labels.json'
 
 # Create upload folder if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Global variables for model and labels
-model = None
+interpreter = None
 labels = {}
 
+# The TFLite interpreter is not thread-safe; serialize invocations
+_interpreter_lock = threading.Lock()
+_input_index = None
+_output_index = None
+
 # Load model and labels at startup
 print("="*50)
 print("Loading Math OCR Model...")
 print("="*50)
 
 try:
-    # Set verbose=False to keep terminal clean
-    model = load_model(MODEL_PATH, compile=False) 
-    print("✓ Model loaded successfully!")
+    # TFLite drops the full TF graph executor in favour of XNNPack kernels —
+    # far lower latency and RAM for a single 32x32 image per request
+    interpreter = tf.lite.Interpreter(model_path=MODEL_PATH, num_threads=2)
+    interpreter.allocate_tensors()
+    _input_index = interpreter.get_input_details()[0]["index"]
+    _output_index = interpreter.get_output_details()[0]["index"]
+
+    # Warm up once so the first real request doesn't pay initialization cost
+    interpreter.set_tensor(_input_index,
+                           np.zeros((1, 32, 32, 1), dtype=np.float32))
+    interpreter.invoke()
+    print("✓ Model loaded and warmed up!")
 except Exception as e:
     print(f"✗ Error loading model: {e}")
-    model = None
+    interpreter = None
 
 try:
     with open(LABELS_PATH, 'r', encoding='utf-8') as f:
@@ -53,29 +72,26 @@ print("="*50)
 
 def preprocess_image(image_file):
     """
-    Preprocess image for model prediction
-    
+    Decode and resize an uploaded image for model prediction
+
     Args:
         image_file: File object from request
-        
+
     Returns:
-        numpy array ready for prediction
+        (32, 32) uint8 numpy array; normalization happens only if the
+        image survives the blank/noise checks
     """
     try:
-        # Open image and convert to grayscale
-        img = Image.open(io.BytesIO(image_file.read())).convert('L')
-        
+        # Decode straight to grayscale with OpenCV's SIMD kernels — also
+        # matches the training-time pipeline, avoiding train/serve skew
+        img = cv2.imdecode(np.frombuffer(image_file.read(), np.uint8),
+                           cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError("Unsupported or corrupt image data")
+
         # Resize to 32x32 (HASYv2 input size)
-        img = img.resize((32, 32))
-        
-        # Convert to numpy array and normalize to 0-1
-        img_array = np.array(img) / 255.0
-        
-        # Reshape for model input: (1, 32, 32, 1)
-        img_array = img_array.reshape(1, 32, 32, 1)
-        
-        return img_array
-    
+        return cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA)
+
     except Exception as e:
         # Re-raise error to be caught by the /predict route's main try-except block
         raise Exception(f"Error preprocessing image: {str(e)}")
@@ -94,7 +110,7 @@ def predict():
     """
     try:
         # 1. Validation Checks (Omitted for brevity, assumed correct)
-        if model is None:
+        if interpreter is None:
              return jsonify({'success': False, 'error': 'Model not loaded. Please check server logs.'}), 500
         if 'image' not in request.files or request.files['image'].filename == '':
              return jsonify({'success': False, 'error': 'No image provided in the request.'}), 400
@@ -102,12 +118,13 @@ def predict():
         file = request.files['image']
         
         # 2. Preprocess and Predict
-        img_array = preprocess_image(file)
+        img_u8 = preprocess_image(file)
 
-        # Extra safety: reject obviously blank or noisy uploads before model inference
-        flat = img_array.squeeze()
-        foreground_fraction = float(np.mean(flat < 0.85))  # proportion of dark pixels
-        std_dev = float(np.std(flat))
+        # Extra safety: reject obviously blank or noisy uploads before model
+        # inference. Computed on the raw uint8 pixels so rejected requests
+        # skip the float conversion and the model call entirely.
+        foreground_fraction = float(np.mean(img_u8 < 217))  # dark pixels (0.85 * 255)
+        std_dev = float(np.std(img_u8)) / 255.0
 
         if std_dev < MIN_STD_DEV or foreground_fraction < MIN_FOREGROUND_FRACTION or foreground_fraction > MAX_FOREGROUND_FRACTION:
             return jsonify({
@@ -116,7 +133,13 @@ def predict():
                 'message': 'No math symbol recognised.'
             })
 
-        predictions = model.predict(img_array, verbose=0)
+        # Normalize and reshape only now that the image looks like a symbol
+        img_array = (img_u8.astype(np.float32) / 255.0).reshape(1, 32, 32, 1)
+
+        with _interpreter_lock:
+            interpreter.set_tensor(_input_index, img_array)
+            interpreter.invoke()
+            predictions = interpreter.get_tensor(_output_index)
         
         # Get top prediction details
         top_idx = np.argmax(predictions[0])
@@ -183,7 +206,7 @@ def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'model_loaded': model is not None,
+        'model_loaded': interpreter is not None,
         'labels_loaded': len(labels) > 0,
         'num_classes': len(labels)
     })
@@ -191,14 +214,14 @@ def health():
 @app.route('/info')
 def info():
     """Get model information"""
-    if model is None:
+    if interpreter is None:
         return jsonify({'error': 'Model not loaded'}), 500
-    
+
     return jsonify({
         'model_name': 'Handwritten Math Symbol Recognition',
         'num_classes': len(labels),
         'input_shape': [32, 32, 1],
-        'framework': 'TensorFlow/Keras',
+        'framework': 'TensorFlow Lite',
         'dataset': 'HASYv2'
     })
 
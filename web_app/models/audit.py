@@ -6,12 +6,30 @@ This script identifies and corrects symbols that have wrong LaTeX/Unicode
 import json
 import os
 import pandas as pd
+from types import MappingProxyType
+
+# Comprehensive LaTeX to Unicode mapping — built once at import and frozen
+LATEX_TO_UNICODE = MappingProxyType({
+    '\\alpha': 'α', '\\beta': 'β', '\\gamma': 'γ', '\\delta': 'δ',
+    '\\epsilon': 'ε', '\\zeta': 'ζ', '\\eta': 'η', '\\theta': 'θ',
+    '\\lambda': 'λ', '\\mu': 'μ', '\\sigma': 'σ', '\\pi': 'π',
+    '\\sum': '∑', '\\int': '∫', '\\infty': '∞', '\\pm': '±',
+    '\\times': '×', '\\div': '÷', '\\leq': '≤', '\\geq': '≥',
+    '\\neq': '≠', '\\approx': '≈', '\\in': '∈', '\\subset': '⊂',
+    '\\forall': '∀', '\\exists': '∃', '\\rightarrow': '→',
+    '\\Rightarrow': '⇒', '\\blacksquare': '■', '\\square': '□',
+    # Add more as needed
+    **{str(i): str(i) for i in range(10)},
+    **{chr(i): chr(i) for i in range(ord('a'), ord('z') + 1)},
+    **{chr(i): chr(i) for i in range(ord('A'), ord('Z') + 1)},
+})
 
 def audit_labels():
     """Audit labels.json for incorrect mappings"""
     
     
-    dataset_path = "C:\Users\USER\Documents\HandwrittenMathOCR\Model_Training\dataset\HASYv2"
+    dataset_path = r"C:\Users\USER\Documents\HandwrittenMathOCR\Model_Training\dataset\HASYv2"
+    models_dir = ""  # labels.json / reverse_mapping.json live in the working dir
     
     print("="*70)
     print("AUDITING LABELS.JSON")
@@ -29,11 +47,9 @@ def audit_labels():
     
     print(f"✓ Loaded {len(labels)} labels")
     
-    # Count occurrences of each LaTeX symbol
-    latex_counts = {}
-    for idx, info in labels.items():
-        latex = info.get('latex', '')
-        latex_counts[latex] = latex_counts.get(latex, 0) + 1
+    # Count occurrences of each LaTeX symbol (vectorized via value_counts)
+    latex_series = pd.Series([info.get('latex', '') for info in labels.values()])
+    latex_counts = latex_series.value_counts().to_dict()
     
     print("\n" + "="*70)
     print("LATEX SYMBOL FREQUENCY")
@@ -64,19 +80,19 @@ def audit_labels():
     hasy_df = pd.read_csv(hasy_csv_path)
     print(f"✓ Loaded HASYv2 dataset: {len(hasy_df)} samples")
     
-    # Get unique symbols from original dataset
+    # Get unique symbols from original dataset (column-wise, no iterrows)
     unique_symbols = hasy_df.drop_duplicates(subset=['symbol_id'])
-    original_mapping = {}
-    
-    for _, row in unique_symbols.iterrows():
-        sid = int(row['symbol_id'])
-        latex = str(row['latex'])
-        unicode_val = str(row.get('unicode', ''))
-        
-        original_mapping[sid] = {
-            'latex': latex,
-            'unicode': unicode_val if unicode_val != 'nan' else ''
-        }
+    latex_col = unique_symbols['latex'].astype(str)
+
+    if 'unicode' in unique_symbols.columns:
+        unicode_col = unique_symbols['unicode'].astype(str).replace('nan', '')
+    else:
+        unicode_col = pd.Series('', index=unique_symbols.index)
+
+    original_mapping = {
+        int(sid): {'latex': latex, 'unicode': unicode_val}
+        for sid, latex, unicode_val in zip(unique_symbols['symbol_id'], latex_col, unicode_col)
+    }
     
     print(f"✓ Original dataset has {len(original_mapping)} unique symbols")
     
@@ -151,23 +167,7 @@ def fix_labels(original_mapping, reverse_mapping, models_dir):
     print("\n" + "="*70)
     print("FIXING LABELS.JSON")
     print("="*70)
-    
-    # Comprehensive LaTeX to Unicode mapping
-    LATEX_TO_UNICODE = {
-        '\\alpha': 'α', '\\beta': 'β', '\\gamma': 'γ', '\\delta': 'δ',
-        '\\epsilon': 'ε', '\\zeta': 'ζ', '\\eta': 'η', '\\theta': 'θ',
-        '\\lambda': 'λ', '\\mu': 'μ', '\\sigma': 'σ', '\\pi': 'π',
-        '\\sum': '∑', '\\int': '∫', '\\infty': '∞', '\\pm': '±',
-        '\\times': '×', '\\div': '÷', '\\leq': '≤', '\\geq': '≥',
-        '\\neq': '≠', '\\approx': '≈', '\\in': '∈', '\\subset': '⊂',
-        '\\forall': '∀', '\\exists': '∃', '\\rightarrow': '→',
-        '\\Rightarrow': '⇒', '\\blacksquare': '■', '\\square': '□',
-        # Add more as needed
-        **{str(i): str(i) for i in range(10)},
-        **{chr(i): chr(i) for i in range(ord('a'), ord('z') + 1)},
-        **{chr(i): chr(i) for i in range(ord('A'), ord('Z') + 1)},
-    }
-    
+
     new_labels = {}
     
     if reverse_mapping: